@@ -2,24 +2,72 @@
 
 import pibooth
 from pibooth.utils import LOGGER
-from threading import Thread
-from time import sleep
-from enum import Enum
-from queue import Queue
+from threading import Thread, Event
+from time import monotonic, monotonic_ns
+from enum import IntEnum
+from collections import namedtuple
 import colorsys
-import random
+import math
 
 try:
     import board
     import adafruit_ws2801
 except ImportError:
-    LOGGER.info("No WS2801 LED support found")
     adafruit_ws2801 = None
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 __version__ = "1.0.0"
 
+#Number of entries in the hue lookup table (must be a power of 2)
+HUE_LUT_SIZE = 256
+
+#Converts arrays of h, s, v values to RGB pixels (uint8) into out
+def hsv_fill(h, s, v, out):
+    for k in range(h.shape[0]):
+        hue = h[k] * 6.0
+        i = int(math.floor(hue))
+        f = hue - i
+        i = i % 6
+        p = v[k] * (1.0 - s[k])
+        q = v[k] * (1.0 - s[k] * f)
+        t = v[k] * (1.0 - s[k] * (1.0 - f))
+        if i == 0:
+            r, g, b = v[k], t, p
+        elif i == 1:
+            r, g, b = q, v[k], p
+        elif i == 2:
+            r, g, b = p, v[k], t
+        elif i == 3:
+            r, g, b = p, q, v[k]
+        elif i == 4:
+            r, g, b = t, p, v[k]
+        else:
+            r, g, b = v[k], p, q
+        out[k, 0] = round(r * 255.0)
+        out[k, 1] = round(g * 255.0)
+        out[k, 2] = round(b * 255.0)
+
+#Compile to native code if numba is installed (otherwise hsv_array is used)
+#Signature is given to compile when the plugin is loaded, not on first frame
+if njit:
+    hsv_fill = njit("void(float64[:], float64[:], float64[:], uint8[:, :])", cache=True, fastmath=True)(hsv_fill)
+
 #State of LED
-class LedState(Enum):
+class LedState(IntEnum):
     RECONFIGURE = 1     #Reconfigure the SPS connection
     WAIT = 2            #Show wait animation
     WAIT_OR_PRINT = 3   #Show wait animation (print possible)
@@ -33,60 +81,103 @@ class LedState(Enum):
     FAILSAFE = 11       #Show fail safe animation
     TERMINATE = 12      #Exit application (switch off LED)
 
+#Frame period (in seconds) of animated states, other states are static
+FRAME_PERIODS = {
+    LedState.WAIT: 0.1,
+    LedState.WAIT_OR_PRINT: 0.1,
+    LedState.CHOOSE: 0.01,
+    LedState.CAPTURE: 0.05,
+    LedState.PROCESSING: 0.5,
+    LedState.PRINT: 0.2,
+}
+
+#Colors
+BLACK = (0x00, 0x00, 0x00)
+WHITE = (0xFF, 0xFF, 0xFF)
+FINISH_COLOR = (0xCC, 0xAA, 0x10)
+
+#Configuration of a button blinker (times in ms)
+BlinkProfile = namedtuple("BlinkProfile", ("color_on", "color_off", "time_on", "time_off", "enabled"))
+
+BLINK_OFF = BlinkProfile(BLACK, BLACK, 500, 500, False)
+
+#Left and right buttons blinkers of states, other states keep the previous one
+BLINK_PROFILES = {
+    LedState.WAIT: (BlinkProfile(WHITE, BLACK, 500, 500, True),
+                    BLINK_OFF),
+    LedState.WAIT_OR_PRINT: (BlinkProfile(WHITE, BLACK, 500, 500, True),
+                             BlinkProfile(BLACK, WHITE, 500, 500, True)),
+    LedState.CHOOSE: (BlinkProfile((0xFF, 0x0, 0x0), BLACK, 200, 200, True),
+                      BlinkProfile((0, 0xFF, 0), BLACK, 200, 200, True)),
+    LedState.CHOSEN: (BLINK_OFF, BLINK_OFF),
+    LedState.PRINT: (BlinkProfile((0x00, 0xAA, 0x55), BLACK, 200, 600, True),
+                     BlinkProfile((0, 0xFF, 0xBC), BLACK, 200, 600, True)),
+    LedState.FINISH: (BLINK_OFF, BLINK_OFF),
+}
+
 # A stupid LED blinker for buttons
 class LedBlinker:
 
     def __init__(self):
-        self.time_off = 0.5
-        self.time_on = 0.5
+        self.time_off = 500     #Time off (ms)
+        self.time_on = 500      #Time on (ms)
         self.color_on = None
         self.color_off = None
         self.is_on = False
-        self.elapsed = 0
+        self.edge = 0           #Time of next toggle (monotonic, ns)
         self.enabled = False
     
-    def animate(self, lastRefresh=0.01):
+    def animate(self):
         changed = False
         if self.enabled:
-            self.elapsed += lastRefresh
-            if self.is_on:
-                if self.elapsed >= self.time_on:
-                    self.is_on = False
-                    self.elapsed = 0
-                    changed = True
-            else:
-                if self.elapsed >= self.time_off:
-                    self.is_on = True
-                    self.elapsed = 0
-                    changed = True
+            now = monotonic_ns()
+            if now >= self.edge:
+                self.is_on = not self.is_on
+                self.edge += (self.time_on if self.is_on else self.time_off) * 1000000
+                if self.edge <= now:
+                    #Late, restart from now
+                    self.edge = now + (self.time_on if self.is_on else self.time_off) * 1000000
+                changed = True
         return changed
 
     def get_color(self):
         if not self.enabled:
-            return (0,0,0)
+            return BLACK
         if self.is_on:
             return self.color_on
         else:
             return self.color_off
 
-    def set_time_on(self, time):
-        self.time_on = time
-    
-    def set_time_off(self, time):
-        self.time_off = time
-
-    def set_color_on(self, color):
-        self.color_on = color
-
-    def set_color_off(self, color):
-        self.color_off = color
-
-    def set_enabled(self, enabled):
+    def configure(self, color_on, color_off, time_on, time_off, enabled):
+        self.color_on = color_on
+        self.color_off = color_off
+        self.time_on = time_on
+        self.time_off = time_off
         self.enabled = enabled
-    
+
     def reset(self):
-        self.elapsed = 0
         self.is_on = False
+        self.edge = monotonic_ns() + self.time_off * 1000000
+
+#WS2801 LED strip written directly to the SPI device (instead of adafruit_ws2801)
+class SpiDevWS2801:
+
+    def __init__(self, bus, led_count, baudrate=1000000):
+        self._spi = spidev.SpiDev()
+        self._spi.open(bus, 0)
+        self._spi.max_speed_hz = baudrate
+        self._spi.mode = 0
+        self._buf = numpy.zeros((led_count, 3), dtype=numpy.uint8)
+
+    def __setitem__(self, index, value):
+        self._buf[index] = value
+
+    def fill(self, color):
+        self._buf[:] = color
+
+    def show(self):
+        #Buffer is sent as is, without conversion
+        self._spi.writebytes2(self._buf.reshape(-1))
 
 #Class for controling WS2801 LED strip
 class LedsWS2801(Thread):
@@ -94,32 +185,75 @@ class LedsWS2801(Thread):
     def __init__(self):
         super().__init__(daemon=True)
         self.name = "LEDStrip"
-        self.state_queue = Queue()
+        self._latest_state = (None, None)   #Last requested state and its payload
+        self._reconfigure = Event()         #Set when configuration changed
+        self._wake = Event()                #Set when a new state is requested
         self.leds = None
         self.spi_index = -1
         self.led_count = -1
         self.left_btn_led = -1      #Left button LED
         self.right_btn_led = -1     #Right button LED
         self.actual_state = None    #Actual state
+        self._payload = None        #Data sent with the actual state
+        self._last_cfg = None       #Last configuration applied
+        self._logged_no_leds = False    #"No LED" already logged
         self.hue_value = 0.0        #Hue value for animation
-        self.delay = 0              #Variable to introduce delay
+        self.delay = 0              #Frames since last state change
+        self._pixbuf = None         #Pixels buffer (RGB, uint8)
+        self._hue_lut = None        #Hue to RGB lookup table
+        self._hue_steps = None      #Hue LUT offset of each LED
+        self._rng = None            #Random generator for animation
+        self._pattern = None        #Pattern of rotating animations
+        self._offset = 0            #Rotation of the pattern
         self.left_btn_blinker = LedBlinker()
         self.right_btn_blinker = LedBlinker()
+        #Animation of each state
+        self._animators = {
+            LedState.WAIT: self.animate_wait,
+            LedState.WAIT_OR_PRINT: self.animate_wait,
+            LedState.CHOOSE: self.animate_choose,
+            LedState.CHOSEN: self.animate_chosen,
+            LedState.PREVIEW: self.animate_preview,
+            LedState.CAPTURE: self.animate_capture,
+            LedState.PROCESSING: self.animate_processing,
+            LedState.PRINT: self.animate_print,
+            LedState.FINISH: self.animate_finish,
+        }
 
     def configure(self):
         #configure the SPI
         if(self.spi_index > -1) and (self.led_count > 0):
             #SPI index set
-            if(not adafruit_ws2801):
-                LOGGER.info("adafruit_ws2801 is not installed. No LED supported")
+            self.leds = None
+            if(not numpy):
+                LOGGER.info("numpy is not installed. No LED supported")
                 self.spi_index = -1
-                self.leds = None
-            else:
-                LOGGER.info("Intializing LED strip on SPI '%d'", self.spi_index)
-                if(self.spi_index == 0):
-                    self.leds = adafruit_ws2801.WS2801(board.SCK, board.MOSI, self.led_count, auto_write=False)
-                elif(self.spi_index == 1):
-                    self.leds = adafruit_ws2801.WS2801(board.SCK_1, board.MOSI_1, self.led_count, auto_write=False)
+            elif(spidev):
+                LOGGER.info("Intializing LED strip on SPI '%d' with spidev", self.spi_index)
+                try:
+                    self.leds = SpiDevWS2801(self.spi_index, self.led_count)
+                except OSError as ex:
+                    LOGGER.warning("Unable to open SPI '%d' with spidev: %s", self.spi_index, ex)
+            if(self.leds == None) and (self.spi_index > -1):
+                if(adafruit_ws2801):
+                    LOGGER.info("Intializing LED strip on SPI '%d'", self.spi_index)
+                    if(self.spi_index == 0):
+                        self.leds = adafruit_ws2801.WS2801(board.SCK, board.MOSI, self.led_count, auto_write=False)
+                    elif(self.spi_index == 1):
+                        self.leds = adafruit_ws2801.WS2801(board.SCK_1, board.MOSI_1, self.led_count, auto_write=False)
+                else:
+                    if(spidev):
+                        LOGGER.info("adafruit_ws2801 is not installed. No LED supported")
+                    else:
+                        LOGGER.info("No WS2801 LED support found: neither spidev nor adafruit_ws2801 is installed")
+                    self.spi_index = -1
+            if(self.leds):
+                self._pixbuf = numpy.zeros((self.led_count, 3), dtype=numpy.uint8)
+                self._pattern = numpy.zeros((self.led_count, 3), dtype=numpy.uint8)
+                hsv = self.hsv
+                self._hue_lut = numpy.array([hsv(h/HUE_LUT_SIZE) for h in range(HUE_LUT_SIZE)], dtype=numpy.uint8)
+                self._hue_steps = (numpy.arange(self.led_count) * HUE_LUT_SIZE) // self.led_count
+                self._rng = numpy.random.default_rng()
 
         else:
             #No SPI
@@ -127,233 +261,250 @@ class LedsWS2801(Thread):
             self.leds = None
         # We will wait for next state
         self.actual_state = None
+        self._logged_no_leds = False
+
+    #Gets the frame period of the actual state (None if static)
+    def get_period(self):
+        if self.actual_state == LedState.CAPTURE and self.delay >= 2:
+            #Capture is static once all LEDs are on
+            return None
+        return FRAME_PERIODS.get(self.actual_state)
+
+    #Gets the time to wait for the next frame (None if nothing to animate)
+    def get_timeout(self, next_frame):
+        if self.leds == None:
+            return None
+        deadlines = []
+        if self.get_period():
+            deadlines.append(next_frame)
+        if self.left_btn_led > -1 and self.left_btn_blinker.enabled:
+            deadlines.append(self.left_btn_blinker.edge / 1e9)
+        if self.right_btn_led > -1 and self.right_btn_blinker.enabled:
+            deadlines.append(self.right_btn_blinker.edge / 1e9)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - monotonic())
 
     #Thread function
     def run(self):
         while True:
             # Waits for the configuration message
             LOGGER.info("Waiting for LED strip configuration")
-            state = self.state_queue.get()
-            LOGGER.info("Got state '%s'", str(state))
-            if(state == LedState.RECONFIGURE):
+            (state, _), reconfigure = self.wait_state()
+            LOGGER.info("Got state '%s'", getattr(state, "name", state))
+            if(reconfigure):
                 LOGGER.info("Reconfiguring")
                 break
         while True:
             #Configure LEDs            
             self.configure()
+            #Reload the latest state without waiting
+            self._wake.set()
+            next_frame = monotonic()
             while True:
                 changed = False
                 do_refresh = False
-                sleep(0.01) #Do action every 10ms
-                if not self.state_queue.empty():
-                    #Got a new state in the queue
-                    new_state = self.state_queue.get()
-                    if(self.actual_state != new_state):
-                        LOGGER.info("Switching state to '%s'", new_state)
-                        changed = True
-                    self.actual_state = new_state
-                if self.actual_state == LedState.RECONFIGURE:
+                #Sleeps until next frame or a new state
+                (new_state, payload), reconfigure = self.wait_state(self.get_timeout(next_frame))
+                if reconfigure:
                     break
+                if(self.actual_state != new_state) or (self._payload != payload):
+                    LOGGER.info("Switching state to '%s'", getattr(new_state, "name", new_state))
+                    changed = True
+                self.actual_state = new_state
+                self._payload = payload
+                now = monotonic()
                 if self.actual_state == LedState.TERMINATE:
                     if self.leds:
-                        self.leds.fill((0x00, 0x00, 0x00))
+                        self.leds.fill(BLACK)
                         self.leds.show()
                     return
                 elif self.leds == None:
-                    LOGGER.info("No LED...")
-                    sleep(2)
+                    if not self._logged_no_leds:
+                        LOGGER.info("No LED...")
+                        self._logged_no_leds = True
                     # No leds available, ignore states
                     continue
-                elif self.actual_state == LedState.WAIT or \
-                    self.actual_state == LedState.WAIT_OR_PRINT:
-                    do_refresh = self.animate_wait(changed)
-                    if changed:
-                        self.left_btn_blinker.set_color_on((0xFF, 0xFF, 0xFF))
-                        self.left_btn_blinker.set_color_off((0, 0, 0))
-                        self.left_btn_blinker.set_enabled(True)
-                        self.left_btn_blinker.set_time_on(0.5)
-                        self.left_btn_blinker.set_time_off(0.5)
-                        if self.actual_state == LedState.WAIT_OR_PRINT:
-                            self.right_btn_blinker.set_color_on((0, 0, 0))
-                            self.right_btn_blinker.set_color_off((0xFF, 0xFF, 0xFF))
-                            self.right_btn_blinker.set_enabled(True)
-                            self.right_btn_blinker.set_time_on(0.5)
-                            self.right_btn_blinker.set_time_off(0.5)
-                        else:
-                            self.right_btn_blinker.set_enabled(False)
-                elif self.actual_state == LedState.CHOOSE:
-                    do_refresh = self.animate_choose(changed)
-                    if changed:
-                        self.left_btn_blinker.set_color_on((0xFF, 0x0, 0x0))
-                        self.left_btn_blinker.set_color_off((0, 0, 0))
-                        self.left_btn_blinker.set_enabled(True)
-                        self.left_btn_blinker.set_time_on(0.2)
-                        self.left_btn_blinker.set_time_off(0.2)
-
-                        self.right_btn_blinker.set_color_on((0, 0xFF, 0))
-                        self.right_btn_blinker.set_color_off((0, 0, 0))
-                        self.right_btn_blinker.set_enabled(True)
-                        self.right_btn_blinker.set_time_on(0.2)
-                        self.right_btn_blinker.set_time_off(0.2)
-                elif self.actual_state == LedState.CHOSEN:
-                    do_refresh = self.animate_chosen(changed)
-                    if changed:
-                        self.left_btn_blinker.set_enabled(False)
-                        self.right_btn_blinker.set_enabled(False)                        
-                elif self.actual_state == LedState.PREVIEW:
-                    do_refresh = self.animate_preview(changed)
-                elif self.actual_state == LedState.CAPTURE:                    
-                    do_refresh = self.animate_capture(changed)
-                elif self.actual_state == LedState.PROCESSING:
-                    do_refresh = self.animate_processing(changed)
-                elif self.actual_state == LedState.PRINT:
-                    do_refresh = self.animate_print(changed)
-                    if changed:
-                        self.left_btn_blinker.set_color_on((0x00, 0xAA, 0x55))
-                        self.left_btn_blinker.set_color_off((0, 0, 0))
-                        self.left_btn_blinker.set_enabled(True)
-                        self.left_btn_blinker.set_time_on(0.2)
-                        self.left_btn_blinker.set_time_off(0.6)
-
-                        self.right_btn_blinker.set_color_on((0, 0xFF, 0xBC))
-                        self.right_btn_blinker.set_color_off((0, 0, 0))
-                        self.right_btn_blinker.set_enabled(True)
-                        self.right_btn_blinker.set_time_on(0.2)
-                        self.right_btn_blinker.set_time_off(0.6)
-                elif self.actual_state == LedState.FINISH:
-                    self.leds.fill((0xCC, 0xAA, 0x10))
-                    do_refresh = changed
-                    if changed:
-                        self.left_btn_blinker.set_enabled(False)
-                        self.right_btn_blinker.set_enabled(False)  
+                #Configure the buttons on state change
+                if changed:
+                    self.delay = 0
+                    profiles = BLINK_PROFILES.get(self.actual_state)
+                    if profiles:
+                        self.left_btn_blinker.configure(*profiles[0])
+                        self.right_btn_blinker.configure(*profiles[1])
+                #Animate the strip when a new frame is due
+                period = self.get_period()
+                if changed or (period and now >= next_frame):
+                    if period:
+                        next_frame = now + period
+                    animate = self._animators.get(self.actual_state)
+                    if animate:
+                        do_refresh = animate(changed)
 
-                left_led = None
-                right_led = None
                 #Animate buttons
                 if self.left_btn_led > -1:
-                    left_led = self.leds[self.left_btn_led]
                     if changed:
                         self.left_btn_blinker.reset()
                     do_refresh |= self.left_btn_blinker.animate()
-                    self.leds[self.left_btn_led] = self.left_btn_blinker.get_color()
-                
+
                 if self.right_btn_led > -1:
-                    right_led = self.leds[self.right_btn_led]
                     if changed:
                         self.right_btn_blinker.reset()
                     do_refresh |= self.right_btn_blinker.animate()
-                    self.leds[self.right_btn_led] = self.right_btn_blinker.get_color()
-                
+
                 #Refresh LED strip if needed
                 if do_refresh:
-                    self.leds.show()
-                #Restore leds values for button, use for shifting
-                if left_led:
-                    self.leds[self.left_btn_led] = left_led
-                if right_led:
-                    self.leds[self.right_btn_led] = right_led
+                    self.show()
+
+    #Sends the pixels buffer to the LED strip, with buttons on top of it
+    def show(self):
+        leds = self.leds
+        leds[:] = self._pixbuf
+        if self.left_btn_led > -1:
+            leds[self.left_btn_led] = self.left_btn_blinker.get_color()
+        if self.right_btn_led > -1:
+            leds[self.right_btn_led] = self.right_btn_blinker.get_color()
+        leds.show()
 
     #Convert a hue value to RGB useable by the adafruit lib
     @staticmethod
     def hsv(h, s=1.0, v=1.0):
         return tuple(round(i * 255) for i in colorsys.hsv_to_rgb(h,s,v))
 
+    #Vectorized version of hsv, returns an array of RGB (uint8) pixels
+    @staticmethod
+    def hsv_array(h, s=1.0, v=1.0):
+        h = numpy.asarray(h, dtype=numpy.float64)
+        s = numpy.broadcast_to(s, h.shape)
+        v = numpy.broadcast_to(v, h.shape)
+        i = numpy.floor(h * 6.0)
+        f = (h * 6.0) - i
+        p = v * (1.0 - s)
+        q = v * (1.0 - s * f)
+        t = v * (1.0 - s * (1.0 - f))
+        i = i.astype(numpy.intp) % 6
+        r = numpy.choose(i, (v, q, p, p, t, v))
+        g = numpy.choose(i, (t, v, v, q, p, p))
+        b = numpy.choose(i, (p, p, t, v, v, q))
+        return numpy.rint(numpy.stack((r, g, b), axis=-1) * 255).astype(numpy.uint8)
+
     #Animate the wait state
     def animate_wait(self, changed):
-        update = False
-        if(changed):
-            self.delay = 0
-        self.delay = self.delay + 1
-        if self.delay > 10 :
-            self.delay = 0
-            for i in range(self.led_count):
-                    self.leds[i] = self.hsv(random.random(), s=(random.randint(50, 100)/100), v=random.random())
-            update = True
-        return update
+        #Buffer size, led_count may already be changed by a new configuration
+        n = len(self._pixbuf)
+        rng = self._rng
+        h = rng.random(n)
+        s = rng.integers(50, 101, n)/100
+        v = rng.random(n)
+        if(njit):
+            hsv_fill(h, s, v, self._pixbuf)
+        else:
+            self._pixbuf[:] = self.hsv_array(h, s, v)
+        return True
 
     #Animate the choose state
     def animate_choose(self, changed):
-        for i in range(self.led_count):
-                self.leds[i] = self.hsv(self.hue_value + (i/self.led_count))
-        self.hue_value = self.hue_value + 0.01
-        if self.hue_value > 1.0 :
-                self.hue_value = 0.0
+        hv = self.hue_value
+        idx = (int(hv * HUE_LUT_SIZE) + self._hue_steps) & (HUE_LUT_SIZE - 1)
+        self._pixbuf[:] = self._hue_lut[idx]
+        hv = hv + 0.01
+        if hv > 1.0 :
+                hv = 0.0
+        self.hue_value = hv
         return True
 
     #Animate the chosen state
     def animate_chosen(self, changed):
-        self.leds.fill(self.hsv(self.actual_state.capture_nbr/4+0.5))
-        return True
+        self._pixbuf[:] = self.hsv(self._payload/4+0.5)
+        return changed
 
     #Animate the previwe state
     def animate_preview(self, changed):
         #Put all on
-        self.leds.fill((0xFF, 0xFF, 0xFF))
-        return True
+        self._pixbuf[:] = WHITE
+        return changed
     
     #Animate the preview state
     def animate_capture(self, changed):
-        #Put all on
-        if(changed):
-            self.delay = 0
+        #Put all on after the first frame
         self.delay = self.delay + 1
-        if self.delay > 4:
-            self.leds.fill((0xFF, 0xFF, 0xFF))
+        if self.delay == 1:
+            self._pixbuf[:] = BLACK
+        elif self.delay == 2:
+            self._pixbuf[:] = WHITE
         else:
-            self.leds.fill((0x0, 0x0, 0x0))
+            #Nothing changed since last frame
+            return False
         return True
 
+    #Sets the pattern to rotate, starting at first LED
+    def set_pattern(self):
+        self._offset = 0
+        self._pixbuf[:] = self._pattern
+
+    #Rotates the pattern by one LED into the pixels buffer
+    def rotate(self):
+        #Pattern size, led_count may already be changed by a new configuration
+        n = len(self._pattern)
+        offset = (self._offset + 1) % n
+        self._offset = offset
+        self._pixbuf[:n-offset] = self._pattern[offset:]
+        self._pixbuf[n-offset:] = self._pattern[:offset]
+
     #Animate the processing state
     def animate_processing(self, changed):
-        update = False
         if(changed):
-            self.delay = 0
-            for i in range(0, self.led_count-2, 3):
-                self.leds[i] = (0xFF, 0x0, 0x0)
-                self.leds[i+1] = (0x0, 0xFF, 0x0)
-                self.leds[i+2] = (0x0, 0x0, 0xFF)
-        self.delay = self.delay + 1
-        if self.delay > 50:
-            self.delay = 0
-            first = self.leds[0]
-            for i in range(0, self.led_count-1):
-                self.leds[i] = self.leds[i+1]
-            self.leds[-1] = first
-            update = True
-        return update
+            last = self.led_count - (self.led_count % 3)
+            self._pattern[:] = 0
+            self._pattern[0:last:3] = (0xFF, 0x0, 0x0)
+            self._pattern[1:last:3] = (0x0, 0xFF, 0x0)
+            self._pattern[2:last:3] = (0x0, 0x0, 0xFF)
+            self.set_pattern()
+        else:
+            self.rotate()
+        return True
 
      #Animate the print state
     def animate_print(self, changed):
-        update = False
         if(changed):
-            self.delay = 0
-            self.leds.fill((0x0, 0x0, 0x0))
-            for i in range(0, self.led_count, 3):
-                self.leds[i] = (0xFF, 0xFF, 0xFF)
-        self.delay = self.delay + 1
-        if self.delay > 20:
-            self.delay = 0
-            first = self.leds[0]
-            for i in range(0, self.led_count-1):
-                self.leds[i] = self.leds[i+1]
-            self.leds[-1] = first
-            update = True
-        return update
+            self._pattern[:] = BLACK
+            self._pattern[0::3] = WHITE
+            self.set_pattern()
+        else:
+            self.rotate()
+        return True
+
+    #Animate the finish state
+    def animate_finish(self, changed):
+        self._pixbuf[:] = FINISH_COLOR
+        return changed
 
     #Set the new state
-    def switchState(self, state):
-        self.state_queue.put_nowait(state)
-
-    #Sets the LED configuration
-    def setConfiguration(self, cfg):
-        spi_name = cfg.get("LEDStrip", "SPI_device")
-        if(spi_name == "None"):
-            spi_index = -1
+    def switchState(self, state, payload=None):
+        if state == LedState.RECONFIGURE:
+            self._reconfigure.set()
         else:
-            spi_index = int(spi_name)
-        led_count = int(cfg.get("LEDStrip", "led_count"))
-        left_btn_led = int(cfg.get("LEDStrip", "left_btn_led"))
-        right_btn_led = int(cfg.get("LEDStrip", "right_btn_led"))
+            #Only the latest state matters (tuple is replaced atomically)
+            self._latest_state = (state, payload)
+        self._wake.set()
+
+    #Waits for a new state (or timeout), returns the latest state and if reconfiguration is needed
+    def wait_state(self, timeout=None):
+        self._wake.wait(timeout)
+        #Clear before reading, a state set after this point wakes us up again
+        self._wake.clear()
+        reconfigure = self._reconfigure.is_set()
+        if reconfigure:
+            self._reconfigure.clear()
+        return self._latest_state, reconfigure
+
+    #Sets the LED configuration (as returned by read_configuration)
+    def setConfiguration(self, configuration):
+        if configuration is self._last_cfg:
+            #Same configuration object, nothing to check
+            return
+        self._last_cfg = configuration
+        spi_index, led_count, left_btn_led, right_btn_led = configuration
         if((self.spi_index != spi_index) or \
             (self.led_count != led_count) or \
             (self.left_btn_led != left_btn_led) or \
@@ -366,6 +517,21 @@ class LedsWS2801(Thread):
             LOGGER.info("Configuration changed, loading it")
             self.switchState(LedState.RECONFIGURE)
 
+#Parsed configuration, refreshed when pibooth (re)loads its configuration
+_configuration = None
+
+#Reads the LED configuration from pibooth configuration
+def read_configuration(cfg):
+    spi_name = cfg.get("LEDStrip", "SPI_device")
+    if(spi_name == "None"):
+        spi_index = -1
+    else:
+        spi_index = int(spi_name)
+    led_count = int(cfg.get("LEDStrip", "led_count"))
+    left_btn_led = int(cfg.get("LEDStrip", "left_btn_led"))
+    right_btn_led = int(cfg.get("LEDStrip", "right_btn_led"))
+    return (spi_index, led_count, left_btn_led, right_btn_led)
+
 # pibooth hooks
 @pibooth.hookimpl
 def state_wait_enter(cfg, app):
@@ -374,7 +540,10 @@ def state_wait_enter(cfg, app):
         app.ledstrip = LedsWS2801()
         app.ledstrip.start()
     # Refresh the configuration, if changed
-    app.ledstrip.setConfiguration(cfg)
+    global _configuration
+    if _configuration is None:
+        _configuration = read_configuration(cfg)
+    app.ledstrip.setConfiguration(_configuration)
     #Set the state
     if app.printer.is_ready() and \
          app.previous_picture:
@@ -390,11 +559,9 @@ def state_choose_enter(cfg, app):
 
 @pibooth.hookimpl
 def state_chosen_enter(cfg, app):
-    LOGGER.info("In state_chosen_enter with {} captures".format(app.capture_nbr))
-    state = LedState.CHOSEN
-    state.capture_nbr = app.capture_nbr
-    #Set the state
-    app.ledstrip.switchState(LedState.CHOSEN)
+    LOGGER.info("In state_chosen_enter with %s captures", app.capture_nbr)
+    #Set the state with the number of captures
+    app.ledstrip.switchState(LedState.CHOSEN, app.capture_nbr)
 
 @pibooth.hookimpl
 def state_preview_enter(cfg, app):
@@ -438,9 +605,13 @@ def pibooth_configure(cfg):
 
 @pibooth.hookimpl
 def pibooth_startup(cfg, app):
-    spi_device = cfg.get("LEDStrip", "SPI_device")
-    LOGGER.info("In pibooth_startup SPI device is %s", spi_device)
+    global _configuration
+    _configuration = read_configuration(cfg)
+    LOGGER.info("In pibooth_startup SPI device is %s", _configuration[0])
 
 @pibooth.hookimpl
 def pibooth_reset(cfg, hard):
+    global _configuration
     LOGGER.info("In pibooth_reset")
+    #Configuration may have been changed
+    _configuration = read_configuration(cfg)